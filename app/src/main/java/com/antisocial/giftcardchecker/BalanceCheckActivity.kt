@@ -93,6 +93,13 @@ class BalanceCheckActivity : AppCompatActivity() {
             return
         }
 
+        // Load and warm up the CAPTCHA model while the page loads
+        if (settingsPreferences.autoCaptchaEnabled && market is TxGateMarket) {
+            lifecycleScope.launch(Dispatchers.Default) {
+                captchaSolver.initialize()
+            }
+        }
+
         // Always use auto-fill - manual entry is not acceptable
         loadBalanceCheckPage()
     }
@@ -6,11 +6,16 @@ import ai.onnxruntime.OrtSession
 import android.content.Context
 import android.graphics.Bitmap
 import android.graphics.Canvas
-import android.graphics.ColorMatrix
-import android.graphics.ColorMatrixColorFilter
 import android.graphics.Paint
+import android.graphics.PorterDuff
+import android.graphics.PorterDuffXfermode
+import android.graphics.Rect
 import android.util.Log
+import androidx.annotation.VisibleForTesting
 import dagger.hilt.android.qualifiers.ApplicationContext
+import java.io.File
+import java.nio.ByteBuffer
+import java.nio.ByteOrder
 import java.nio.FloatBuffer
 import javax.inject.Inject
 import javax.inject.Singleton
@@ -28,38 +33,95 @@ class CaptchaSolver @Inject constructor(
 ) {
     companion object {
         private const val TAG = "CaptchaSolver"
-        private const val MODEL_PATH = "models/epoch_23.onnx"
+        private const val MODEL_DIR = "models"
+        private const val MODEL_FILE = "epoch_23.onnx"
+        // INT8 dynamically quantized variant, preferred when bundled (see documentation/MODEL_SETUP.md)
+        private const val QUANTIZED_MODEL_FILE = "epoch_23.int8.onnx"
+        private const val OPTIMIZED_MODEL_PREFIX = "captcha_model_optimized_"
         private const val INPUT_WIDTH = 215
         private const val INPUT_HEIGHT = 80
 
+        // Input tensor shape: [1, 1, 80, 215] (batch, channels, height, width)
+        private val INPUT_SHAPE = longArrayOf(1, 1, INPUT_HEIGHT.toLong(), INPUT_WIDTH.toLong())
+
+        // Grayscale weights scaled by 1024 (sum = 1024)
+        private const val GRAY_WEIGHT_R = 218
+        private const val GRAY_WEIGHT_G = 732
+        private const val GRAY_WEIGHT_B = 74
+        // Half of 1024, so the shift rounds instead of truncating
+        private const val GRAY_ROUNDING = 512
+
+        // (pixel / 255 - 0.5) / 0.5 == pixel * (2 / 255) - 1
+        private const val NORMALIZE_SCALE = 2.0f / 255.0f
+
+        // Normalized value for every 8-bit gray level, so each pixel needs only a table lookup
+        private val NORMALIZED_GRAY = FloatArray(256) { it * NORMALIZE_SCALE - 1.0f }
+
         // Character set for decoding model output
         // Expanded to include lowercase letters (62 chars total)
         // Order assumption: Digits (10) + Lowercase (26) + Uppercase (26)
+        // Shared by the CTC, direct and Tokenizer decoders (Tokenizer ids are offset by 1)
         private const val CHARSET = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
-        
-        // Character set for Tokenizer model (0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ)
-        private const val TOKENIZER_CHARSET = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+        // CAPTCHAs are at most 6 characters; CTC decoding stops once this many are emitted
+        private const val MAX_CAPTCHA_LENGTH = 6
 
         // CTC blank token index (usually 0 or last index)
         // Based on python implementation: BLANK_IDX = len(CHARS) = 62
         private const val CTC_BLANK_INDEX = 62
         
+        // Class counts tried when the model output is a flat array: charset + blank, 36 + blank, digits + blank
+        private val FLAT_CLASS_COUNTS = listOf(CHARSET.length + 1, 37, 11)
+
         // Tokenizer special tokens
         private const val TOKEN_EOS = 0
     }
 
     private var ortEnvironment: OrtEnvironment? = null
     private var ortSession: OrtSession? = null
+    private var sessionOptions: OrtSession.SessionOptions? = null
     private var isInitialized = false
     private var inputName: String = "input"
-    private var outputShape: LongArray? = null
+    private var outputLayout: OutputLayout? = null
+    private var flatNumClasses: Int? = null
+
+    // Direct, native-order buffer so ONNX Runtime can use it as tensor memory without copying.
+    // Input buffers are reused across solves; solve() is synchronized.
+    private val inputBuffer: FloatBuffer = ByteBuffer
+        .allocateDirect(INPUT_WIDTH * INPUT_HEIGHT * Float.SIZE_BYTES)
+        .order(ByteOrder.nativeOrder())
+        .asFloatBuffer()
+    private val pixelBuffer = IntArray(INPUT_WIDTH * INPUT_HEIGHT)
+    private val scaledBitmap: Bitmap by lazy {
+        Bitmap.createBitmap(INPUT_WIDTH, INPUT_HEIGHT, Bitmap.Config.ARGB_8888)
+    }
+    private val scaleCanvas: Canvas by lazy { Canvas(scaledBitmap) }
+    private val scaleTarget = Rect(0, 0, INPUT_WIDTH, INPUT_HEIGHT)
+    // Bilinear filtering like createScaledBitmap(filter = true); SRC overwrites the previous image
+    private val scalePaint = Paint(Paint.FILTER_BITMAP_FLAG).apply {
+        xfermode = PorterDuffXfermode(PorterDuff.Mode.SRC)
+    }
+
+    /**
+     * Supported model output layouts.
+     */
+    private enum class OutputLayout {
+        TOKENIZER,
+        TIME_MAJOR,
+        BATCH_MAJOR,
+        DIRECT,
+        FLAT
+    }
 
     /**
      * Initialize ONNX Runtime session.
-     * Call this once before using solve().
+     * Call this once before using solve(), ideally off the main thread ahead of time.
+     *
+     * @param warmUp Run one blank inference so the first real solve is not slowed by
+     *   one-time setup. Only useful ahead of time; solve() initializes without it.
      */
     @Synchronized
-    fun initialize(): Boolean {
+    fun initialize(warmUp: Boolean = true): Boolean {
         if (isInitialized) return true
 
         return try {
@@ -67,11 +129,7 @@ class CaptchaSolver @Inject constructor(
 
             ortEnvironment = OrtEnvironment.getEnvironment()
 
-            // Load model from assets
-            val modelBytes = context.assets.open(MODEL_PATH).use { it.readBytes() }
-            Log.d(TAG, "Model loaded: ${modelBytes.size} bytes")
-
-            ortSession = ortEnvironment?.createSession(modelBytes)
+            ortSession = ortEnvironment?.let { createSession(it) }
 
             // Log model info
             ortSession?.let { session ->
@@ -95,6 +153,10 @@ class CaptchaSolver @Inject constructor(
                 }
             }
 
+            if (warmUp) {
+                ortSession?.let { session -> ortEnvironment?.let { env -> runWarmUp(env, session) } }
+            }
+
             isInitialized = true
             Log.d(TAG, "ONNX Runtime initialized successfully")
             true
@@ -104,16 +166,107 @@ class CaptchaSolver @Inject constructor(
         }
     }
 
+    /**
+     * Create the inference session, reusing the graph optimized on a previous app start if available.
+     */
+    private fun createSession(env: OrtEnvironment): OrtSession {
+        val optimizedModel = File(context.cacheDir, optimizedModelFileName())
+
+        if (optimizedModel.exists()) {
+            try {
+                // Graph is already optimized for this device, skip the optimizer
+                val options = createSessionOptions(OrtSession.SessionOptions.OptLevel.NO_OPT)
+                sessionOptions = options
+                Log.d(TAG, "Loading optimized model: ${optimizedModel.name}")
+                return env.createSession(optimizedModel.absolutePath, options)
+            } catch (e: Exception) {
+                Log.w(TAG, "Optimized model unusable, rebuilding from assets", e)
+                sessionOptions?.close()
+                sessionOptions = null
+                optimizedModel.delete()
+            }
+        }
+
+        // Remove optimized models left behind by previous installs
+        context.cacheDir.listFiles { file -> file.name.startsWith(OPTIMIZED_MODEL_PREFIX) }
+            ?.forEach { it.delete() }
+
+        // Load model from assets
+        val modelPath = resolveModelPath()
+        val modelBytes = context.assets.open(modelPath).use { it.readBytes() }
+        Log.d(TAG, "Model loaded: $modelPath, ${modelBytes.size} bytes")
+
+        val options = createSessionOptions(OrtSession.SessionOptions.OptLevel.ALL_OPT)
+        sessionOptions = options
+        // ORT fails session creation when the optimized model cannot be written. Saving is only a
+        // startup optimization, so only request it when the cache can hold a copy of the model.
+        val cacheDir = context.cacheDir
+        if (cacheDir.canWrite() && cacheDir.usableSpace > modelBytes.size) {
+            // Serialize the optimized graph so the next app start can load it directly
+            options.setOptimizedModelFilePath(optimizedModel.absolutePath)
+        } else {
+            Log.w(TAG, "Cache not writable or full, optimized model will not be saved")
+        }
+        return env.createSession(modelBytes, options)
+    }
+
+    /**
+     * Run one inference on a blank input so kernel selection and allocations happen
+     * here rather than on the first real CAPTCHA.
+     */
+    private fun runWarmUp(env: OrtEnvironment, session: OrtSession) {
+        try {
+            inputBuffer.clear()
+            for (i in 0 until inputBuffer.capacity()) {
+                inputBuffer.put(i, 0f)
+            }
+            OnnxTensor.createTensor(env, inputBuffer, INPUT_SHAPE).use { tensor ->
+                session.run(mapOf(inputName to tensor)).close()
+            }
+            Log.d(TAG, "Model warm-up complete")
+        } catch (e: Exception) {
+            // Not fatal, the first solve just pays the warm-up cost instead
+            Log.w(TAG, "Model warm-up failed", e)
+        }
+    }
+
+    /**
+     * Asset path of the model to load, preferring the quantized variant when it is bundled.
+     */
+    private fun resolveModelPath(): String {
+        val bundled = context.assets.list(MODEL_DIR).orEmpty()
+        val file = if (QUANTIZED_MODEL_FILE in bundled) QUANTIZED_MODEL_FILE else MODEL_FILE
+        return "$MODEL_DIR/$file"
+    }
+
+    private fun createSessionOptions(optLevel: OrtSession.SessionOptions.OptLevel): OrtSession.SessionOptions {
+        return OrtSession.SessionOptions().apply {
+            setOptimizationLevel(optLevel)
+            setIntraOpNumThreads(maxOf(1, Runtime.getRuntime().availableProcessors() / 2))
+        }
+    }
+
+    /**
+     * Cache file name for the optimized model, tied to the installed APK so updates invalidate it.
+     */
+    @Suppress("DEPRECATION")
+    private fun optimizedModelFileName(): String {
+        val lastUpdateTime = context.packageManager.getPackageInfo(context.packageName, 0).lastUpdateTime
+        return "$OPTIMIZED_MODEL_PREFIX$lastUpdateTime.onnx"
+    }
+
     /**
      * Solve CAPTCHA from bitmap image.
      *
      * @param bitmap The CAPTCHA image
      * @return The solved CAPTCHA text, or null if solving failed
      */
+    @Synchronized
     fun solve(bitmap: Bitmap): String? {
         if (!isInitialized) {
             Log.w(TAG, "CaptchaSolver not initialized, attempting initialization...")
-            if (!initialize()) {
+            // Warming up here would only add a blank inference before the real one
+            if (!initialize(warmUp = false)) {
                 Log.e(TAG, "Failed to initialize CaptchaSolver")
                 return null
             }
@@ -133,71 +286,23 @@ class CaptchaSolver @Inject constructor(
             Log.d(TAG, "Solving CAPTCHA, input size: ${bitmap.width}x${bitmap.height}")
 
             // Preprocess image
-            val inputArray = preprocess(bitmap)
-            Log.d(TAG, "Preprocessed input size: ${inputArray.size}")
-
-            // Create input tensor
-            // Shape: [1, 1, 80, 215] (batch, channels, height, width)
-            val inputShape = longArrayOf(1, 1, INPUT_HEIGHT.toLong(), INPUT_WIDTH.toLong())
-            val inputTensor = OnnxTensor.createTensor(env, FloatBuffer.wrap(inputArray), inputShape)
-
-            // Run inference
-            val inputs = mapOf(inputName to inputTensor)
-            val results = session.run(inputs)
-
-            // Get output
-            val output = results[0].value
-            Log.d(TAG, "Output type: ${output?.javaClass?.simpleName}")
-
-            val text = when (output) {
-                is Array<*> -> {
-                    // Handle 3D output: [batch, sequence, classes]
-                    @Suppress("UNCHECKED_CAST")
-                    val outputArray = output as? Array<Array<FloatArray>>
-                    if (outputArray != null) {
-                        outputShape = longArrayOf(
-                            outputArray.size.toLong(),
-                            outputArray[0].size.toLong(),
-                            outputArray[0][0].size.toLong()
-                        )
-                        // Check if this is the [1, 26, 95] tokenizer model
-                        if (outputArray.size == 1 && outputArray[0].size == 26 && outputArray[0][0].size == 95) {
-                            decodeTokenizerOutput(outputArray[0])
-                        }
-                        // Check for Time-Major format [Time, Batch, Classes] e.g. [53, 1, 63]
-                        else if (outputArray.size > 1 && outputArray[0].size == 1) {
-                            decodeTimeMajorOutput(outputArray)
-                        }
-                        else {
-                            // Assume standard [Batch, Time, Classes] but we have Batch=1 so outputArray[0] is [Time, Classes]
-                            decodeCtcOutput(outputArray[0])
-                        }
-                    } else {
-                        // Try 2D output: [batch, sequence]
-                        @Suppress("UNCHECKED_CAST")
-                        val output2D = output as? Array<LongArray>
-                        if (output2D != null) {
-                            decodeDirectOutput(output2D[0])
-                        } else {
-                            Log.e(TAG, "Unknown output format in Array<*>")
-                            null
-                        }
-                    }
-                }
-                is FloatArray -> {
-                    // Flat output, needs reshaping
-                    decodeFlat(output)
-                }
-                else -> {
-                    Log.e(TAG, "Unexpected output type: ${output?.javaClass}")
-                    null
+            preprocess(bitmap, inputBuffer)
+            Log.d(TAG, "Preprocessed input size: ${inputBuffer.capacity()}")
+
+            // Create input tensor backed directly by the preallocated buffer (no copy);
+            // use {} closes it and the results on the exception path too
+            val text = OnnxTensor.createTensor(env, inputBuffer, INPUT_SHAPE).use { inputTensor ->
+                // Run inference
+                val inputs = mapOf(inputName to inputTensor)
+                session.run(inputs).use { results ->
+                    // Get output
+                    val output = results[0].value
+                    Log.d(TAG, "Output type: ${output?.javaClass?.simpleName}")
+
+                    decodeOutput(output)
                 }
             }
 
-            // Cleanup
-            inputTensor.close()
-            results.close()
-
             Log.d(TAG, "CAPTCHA solved: $text")
             text
         } catch (e: Exception) {
@@ -207,48 +312,94 @@ class CaptchaSolver @Inject constructor(
     }
 
     /**
-     * Preprocess image: resize to 215x80, convert to grayscale, normalize to [0,1].
+     * Decode the raw model output with the decoder matching its layout.
      */
-    private fun preprocess(bitmap: Bitmap): FloatArray {
-        // Resize to target dimensions
-        val resized = Bitmap.createScaledBitmap(bitmap, INPUT_WIDTH, INPUT_HEIGHT, true)
-
-        // Convert to grayscale
-        val grayscale = toGrayscale(resized)
+    @VisibleForTesting
+    internal fun decodeOutput(output: Any?): String? {
+        // The output layout is fixed per model, so it is only detected on the first solve
+        val layout = outputLayout ?: detectOutputLayout(output)?.also {
+            Log.d(TAG, "Detected output layout: $it")
+            outputLayout = it
+        } ?: return null
+
+        return when (layout) {
+            OutputLayout.TOKENIZER -> decodeTokenizerOutput((output as Array<Array<FloatArray>>)[0])
+            OutputLayout.TIME_MAJOR -> decodeTimeMajorOutput(output as Array<Array<FloatArray>>)
+            // Batch=1, so output[0] is [Time, Classes]
+            OutputLayout.BATCH_MAJOR -> decodeCtcOutput((output as Array<Array<FloatArray>>)[0])
+            OutputLayout.DIRECT -> decodeDirectOutput((output as Array<LongArray>)[0])
+            OutputLayout.FLAT -> decodeFlat(output as FloatArray)
+        }
+    }
 
-        // Extract pixel values and normalize to [0, 1]
-        val pixels = IntArray(INPUT_WIDTH * INPUT_HEIGHT)
-        grayscale.getPixels(pixels, 0, INPUT_WIDTH, 0, 0, INPUT_WIDTH, INPUT_HEIGHT)
+    /**
+     * Determine how to decode the model output from its runtime value.
+     */
+    private fun detectOutputLayout(output: Any?): OutputLayout? {
+        return when {
+            output is FloatArray -> OutputLayout.FLAT
+            output is Array<*> && output.firstOrNull() is Array<*> -> {
+                // 3D output: [batch, sequence, classes] or [sequence, batch, classes]
+                @Suppress("UNCHECKED_CAST")
+                val outputArray = output as Array<Array<FloatArray>>
+                when {
+                    // [1, 26, 95] tokenizer model
+                    outputArray.size == 1 && outputArray[0].size == 26 && outputArray[0][0].size == 95 ->
+                        OutputLayout.TOKENIZER
+                    // Time-Major format [Time, Batch, Classes] e.g. [53, 1, 63]
+                    outputArray.size > 1 && outputArray[0].size == 1 -> OutputLayout.TIME_MAJOR
+                    else -> OutputLayout.BATCH_MAJOR
+                }
+            }
+            // 2D output: [batch, sequence] of character indices
+            output is Array<*> && output.firstOrNull() is LongArray -> OutputLayout.DIRECT
+            output is Array<*> -> {
+                Log.e(TAG, "Unknown output format in Array<*>")
+                null
+            }
+            else -> {
+                Log.e(TAG, "Unexpected output type: ${output?.javaClass}")
+                null
+            }
+        }
+    }
 
-        val floatArray = FloatArray(INPUT_WIDTH * INPUT_HEIGHT)
-        for (i in pixels.indices) {
-            // Extract grayscale value (R, G, B are equal in grayscale)
-            val gray = pixels[i] and 0xFF
-            // Normalize to [-1, 1] as per model requirements: (pixel / 255 - 0.5) / 0.5
-            floatArray[i] = (gray / 255.0f - 0.5f) / 0.5f
+    /**
+     * Preprocess image: resize to 215x80, convert to grayscale, normalize to [-1,1].
+     * Writes the result into [out].
+     */
+    private fun preprocess(bitmap: Bitmap, out: FloatBuffer) {
+        // Resize to target dimensions. Model-sized images (the real CAPTCHAs are 215x80) are read
+        // directly rather than copied through the reusable scaling bitmap.
+        val resized = if (bitmap.width == INPUT_WIDTH && bitmap.height == INPUT_HEIGHT) {
+            bitmap
+        } else {
+            // Scale into the reusable bitmap instead of allocating a new one per solve
+            scaleCanvas.drawBitmap(bitmap, null, scaleTarget, scalePaint)
+            scaledBitmap
         }
 
-        // Cleanup temporary bitmaps
-        if (resized != bitmap) resized.recycle()
-        if (grayscale != resized) grayscale.recycle()
+        val pixels = pixelBuffer
+        resized.getPixels(pixels, 0, INPUT_WIDTH, 0, 0, INPUT_WIDTH, INPUT_HEIGHT)
 
-        return floatArray
+        out.clear()
+        for (i in pixels.indices) {
+            // Grayscale and normalize in one pass instead of drawing an intermediate bitmap.
+            // Stays in integer space until the single float write into the tensor buffer.
+            out.put(i, NORMALIZED_GRAY[toGray(pixels[i])])
+        }
     }
 
     /**
-     * Convert bitmap to grayscale.
+     * Luminance of an ARGB pixel, using the same weights as ColorMatrix.setSaturation(0)
+     * (0.213, 0.715, 0.072) in 10-bit fixed point, rounded to the nearest level.
      */
-    private fun toGrayscale(bitmap: Bitmap): Bitmap {
-        val grayscale = Bitmap.createBitmap(bitmap.width, bitmap.height, Bitmap.Config.ARGB_8888)
-        val canvas = Canvas(grayscale)
-        val paint = Paint()
-
-        val colorMatrix = ColorMatrix()
-        colorMatrix.setSaturation(0f)
-        paint.colorFilter = ColorMatrixColorFilter(colorMatrix)
-
-        canvas.drawBitmap(bitmap, 0f, 0f, paint)
-        return grayscale
+    @VisibleForTesting
+    internal fun toGray(pixel: Int): Int {
+        val r = (pixel shr 16) and 0xFF
+        val g = (pixel shr 8) and 0xFF
+        val b = pixel and 0xFF
+        return (r * GRAY_WEIGHT_R + g * GRAY_WEIGHT_G + b * GRAY_WEIGHT_B + GRAY_ROUNDING) shr 10
     }
 
     /**
@@ -257,31 +408,21 @@ class CaptchaSolver @Inject constructor(
      */
     private fun decodeTokenizerOutput(output: Array<FloatArray>): String {
         val sequenceLength = output.size
-        val result = StringBuilder()
+        val result = StringBuilder(sequenceLength)
 
         for (t in 0 until sequenceLength) {
-            // Find argmax for this timestep
-            var maxIndex = 0
-            var maxValue = output[t][0]
-            val numClasses = output[t].size
-            
-            for (c in 1 until numClasses) {
-                if (output[t][c] > maxValue) {
-                    maxValue = output[t][c]
-                    maxIndex = c
-                }
-            }
-            
+            val maxIndex = argmax(output[t])
+
             // Stop at EOS token
             if (maxIndex == TOKEN_EOS) {
                 break
             }
             
             // Map index to character
-            // Mapping: 1..62 -> TOKENIZER_CHARSET[0..61]
+            // Mapping: 1..62 -> CHARSET[0..61]
             val charIndex = maxIndex - 1
-            if (charIndex >= 0 && charIndex < TOKENIZER_CHARSET.length) {
-                result.append(TOKENIZER_CHARSET[charIndex])
+            if (charIndex >= 0 && charIndex < CHARSET.length) {
+                result.append(CHARSET[charIndex])
             } else {
                 Log.w(TAG, "Index $maxIndex out of bounds for charset")
             }
@@ -292,37 +433,28 @@ class CaptchaSolver @Inject constructor(
 
     /**
      * Decode Time-Major output: [Time, Batch=1, Classes] -> text
-     * Flattens to [Time, Classes] and calls CTC decoder
+     * Runs the CTC decoder directly on the batch-0 row of each timestep
      */
-    private fun decodeTimeMajorOutput(output: Array<Array<FloatArray>>): String {
-        val sequenceLength = output.size
+    private fun decodeTimeMajorOutput(output: Array<Array<FloatArray>>): String =
         // We know batch size is 1, so we take the first element of the second dimension
-        val flattened = Array(sequenceLength) { t ->
-            output[t][0]
-        }
-        return decodeCtcOutput(flattened)
-    }
+        decodeCtc(output.size) { t -> argmax(output[t][0]) }
 
     /**
      * Decode CTC output: [sequence_length, num_classes] -> text
      */
-    private fun decodeCtcOutput(output: Array<FloatArray>): String {
-        val sequenceLength = output.size
-        val numClasses = output[0].size
+    private fun decodeCtcOutput(output: Array<FloatArray>): String =
+        decodeCtc(output.size) { t -> argmax(output[t]) }
 
-        val result = StringBuilder()
+    /**
+     * CTC decoding over [sequenceLength] timesteps, where [argmaxAt] gives the best class of timestep t.
+     * Lets callers decode from any output layout without copying it into [Time, Classes] rows.
+     */
+    private inline fun decodeCtc(sequenceLength: Int, argmaxAt: (Int) -> Int): String {
+        val result = StringBuilder(MAX_CAPTCHA_LENGTH)
         var previousIndex = -1
 
         for (t in 0 until sequenceLength) {
-            // Find argmax for this timestep
-            var maxIndex = 0
-            var maxValue = output[t][0]
-            for (c in 1 until numClasses) {
-                if (output[t][c] > maxValue) {
-                    maxValue = output[t][c]
-                    maxIndex = c
-                }
-            }
+            val maxIndex = argmaxAt(t)
 
             // CTC decoding: skip blank tokens and repeated characters
             if (maxIndex != CTC_BLANK_INDEX && maxIndex != previousIndex) {
@@ -331,19 +463,42 @@ class CaptchaSolver @Inject constructor(
                 if (charIndex >= 0 && charIndex < CHARSET.length) {
                     val char = CHARSET[charIndex]
                     result.append(char)
+                    // Remaining timesteps cannot contribute to the result
+                    if (result.length == MAX_CAPTCHA_LENGTH) break
                 }
             }
             previousIndex = maxIndex
         }
 
-        return result.toString().take(6)
+        return result.toString()
+    }
+
+    /**
+     * Index of the largest value in a timestep's class scores.
+     */
+    private fun argmax(row: FloatArray): Int = argmax(row, 0, row.size)
+
+    /**
+     * Index (relative to [offset]) of the largest value in values[offset until offset + length].
+     */
+    private fun argmax(values: FloatArray, offset: Int, length: Int): Int {
+        var maxIndex = 0
+        var maxValue = values[offset]
+        for (c in 1 until length) {
+            val value = values[offset + c]
+            if (value > maxValue) {
+                maxValue = value
+                maxIndex = c
+            }
+        }
+        return maxIndex
     }
 
     /**
      * Decode direct output (character indices).
      */
     private fun decodeDirectOutput(output: LongArray): String {
-        val result = StringBuilder()
+        val result = StringBuilder(output.size)
         for (idx in output) {
             val charIndex = idx.toInt()
             if (charIndex >= 0 && charIndex < CHARSET.length) {
@@ -357,25 +512,19 @@ class CaptchaSolver @Inject constructor(
      * Decode flat output by trying to infer the shape.
      */
     private fun decodeFlat(output: FloatArray): String? {
-        // Try common shapes
-        val possibleClasses = listOf(CHARSET.length + 1, 37, 63, 11) // +1 for blank
-
-        for (numClasses in possibleClasses) {
-            if (output.size % numClasses == 0) {
-                val sequenceLength = output.size / numClasses
-                Log.d(TAG, "Trying shape: sequence=$sequenceLength, classes=$numClasses")
-
-                // Reshape to 2D
-                val reshaped = Array(sequenceLength) { t ->
-                    FloatArray(numClasses) { c ->
-                        output[t * numClasses + c]
-                    }
-                }
-
-                val result = decodeCtcOutput(reshaped)
-                if (result.isNotEmpty()) {
-                    return result
-                }
+        // A class count that produced a full-length CAPTCHA before is tried first
+        val cachedNumClasses = flatNumClasses
+        val cachedResult = cachedNumClasses?.let { decodeFlatAs(output, it) }
+        if (cachedResult?.length == MAX_CAPTCHA_LENGTH) return cachedResult
+
+        // Otherwise try common shapes in fixed priority order, without decoding the cached count twice
+        for (numClasses in FLAT_CLASS_COUNTS) {
+            val result = (if (numClasses == cachedNumClasses) cachedResult else decodeFlatAs(output, numClasses))
+                ?: continue
+            if (result.isNotEmpty()) {
+                // Only a full-length decode is trusted enough to be tried first next time
+                if (result.length == MAX_CAPTCHA_LENGTH) flatNumClasses = numClasses
+                return result
             }
         }
 
@@ -383,6 +532,18 @@ class CaptchaSolver @Inject constructor(
         return null
     }
 
+    /**
+     * CTC-decode flat output as [size / numClasses, numClasses], or null if the size does not fit.
+     */
+    private fun decodeFlatAs(output: FloatArray, numClasses: Int): String? {
+        if (output.size % numClasses != 0) return null
+        val sequenceLength = output.size / numClasses
+        Log.d(TAG, "Trying shape: sequence=$sequenceLength, classes=$numClasses")
+
+        // Read timesteps in place instead of copying into a reshaped 2D array
+        return decodeCtc(sequenceLength) { t -> argmax(output, t * numClasses, numClasses) }
+    }
+
     /**
      * Check if the solver is ready to use.
      */
@@ -390,16 +551,22 @@ class CaptchaSolver @Inject constructor(
 
     /**
      * Release ONNX resources.
+     * Synchronized with initialize() and solve(), which may be running on a background dispatcher.
      */
+    @Synchronized
     fun release() {
         try {
             ortSession?.close()
+            sessionOptions?.close()
             ortEnvironment?.close()
         } catch (e: Exception) {
             Log.e(TAG, "Error releasing ONNX resources", e)
         }
         ortSession = null
+        sessionOptions = null
         ortEnvironment = null
+        outputLayout = null
+        flatNumClasses = null
         isInitialized = false
     }
 }
@@ -0,0 +1,207 @@
+package com.antisocial.giftcardchecker.captcha
+
+import org.junit.Assert.*
+import org.junit.Before
+import org.junit.Test
+import org.junit.runner.RunWith
+import org.robolectric.RobolectricTestRunner
+import org.robolectric.RuntimeEnvironment
+import org.robolectric.annotation.Config
+import kotlin.math.abs
+import kotlin.random.Random
+
+/**
+ * Unit tests for CaptchaSolver preprocessing and output decoding.
+ */
+@RunWith(RobolectricTestRunner::class)
+@Config(sdk = [28])
+class CaptchaSolverTest {
+
+    private lateinit var solver: CaptchaSolver
+
+    @Before
+    fun setup() {
+        solver = CaptchaSolver(RuntimeEnvironment.getApplication())
+    }
+
+    @Test
+    fun `toGray matches ColorMatrix saturation weights`() {
+        val random = Random(42)
+        var errorSum = 0.0
+        val samples = 200_000
+
+        repeat(samples) {
+            val r = random.nextInt(256)
+            val g = random.nextInt(256)
+            val b = random.nextInt(256)
+            val pixel = (0xFF shl 24) or (r shl 16) or (g shl 8) or b
+
+            val expected = 0.213 * r + 0.715 * g + 0.072 * b
+            val error = solver.toGray(pixel) - expected
+
+            // Rounding error plus the fixed-point weight error
+            assertTrue("Gray for ($r, $g, $b) off by $error", abs(error) <= 0.65)
+            errorSum += error
+        }
+
+        // Rounding must not bias the result in either direction
+        assertEquals(0.0, errorSum / samples, 0.05)
+    }
+
+    @Test
+    fun `toGray keeps black and white at the range limits`() {
+        assertEquals(0, solver.toGray(0xFF000000.toInt()))
+        assertEquals(255, solver.toGray(0xFFFFFFFF.toInt()))
+    }
+
+    @Test
+    fun `decodeOutput decodes flat CTC output`() {
+        // "ab" with a repeat and blanks: a a _ b _
+        val output = flat(oneHot(63, 10, 10, BLANK, 11, BLANK))
+
+        assertEquals("ab", solver.decodeOutput(output))
+    }
+
+    @Test
+    fun `decodeOutput decodes direct index output`() {
+        val output = arrayOf(longArrayOf(1, 2, 3, 36))
+
+        assertEquals("123A", solver.decodeOutput(output))
+    }
+
+    @Test
+    fun `decodeOutput decodes time-major output`() {
+        // [Time, Batch=1, Classes]; blank between the repeated 'a' keeps both
+        val output = timeMajor(oneHot(63, 10, BLANK, 10, 35))
+
+        assertEquals("aaz", solver.decodeOutput(output))
+    }
+
+    @Test
+    fun `decodeOutput decodes batch-major output`() {
+        val output = arrayOf(oneHot(63, 0, 0, 9, BLANK, 61))
+
+        assertEquals("09Z", solver.decodeOutput(output))
+    }
+
+    @Test
+    fun `decodeOutput decodes tokenizer output up to EOS`() {
+        // Tokenizer ids are CHARSET index + 1; 0 is EOS
+        val ids = IntArray(26)
+        ids[0] = 11 // a
+        ids[1] = 2  // 1
+        ids[2] = 38 // B
+        val output = arrayOf(oneHot(95, *ids))
+
+        assertEquals("a1B", solver.decodeOutput(output))
+    }
+
+    @Test
+    fun `decodeOutput keeps the first detected layout`() {
+        // A time-major [Time, Batch=1, Classes] output would be detected as TIME_MAJOR ("cd"),
+        // but the cached BATCH_MAJOR decoder reads output[0] as the whole sequence ("c")
+        val batchMajorSolver = newSolver()
+        assertEquals("ab", batchMajorSolver.decodeOutput(arrayOf(oneHot(63, 10, 11))))
+        assertEquals("c", batchMajorSolver.decodeOutput(timeMajor(oneHot(63, 12, 13))))
+
+        // And the other way round: a batch-major output read by the cached TIME_MAJOR decoder
+        val timeMajorSolver = newSolver()
+        assertEquals("ab", timeMajorSolver.decodeOutput(timeMajor(oneHot(63, 10, 11))))
+        assertEquals("c", timeMajorSolver.decodeOutput(arrayOf(oneHot(63, 12, 13))))
+
+        // A cached DIRECT layout does not fall back to detection for other output types
+        val directSolver = newSolver()
+        assertEquals("ab", directSolver.decodeOutput(arrayOf(longArrayOf(10, 11))))
+        assertThrows(ClassCastException::class.java) {
+            directSolver.decodeOutput(flat(oneHot(63, 12, 13)))
+        }
+    }
+
+    @Test
+    fun `release clears the cached layout`() {
+        assertEquals("ab", solver.decodeOutput(arrayOf(oneHot(63, 10, 11))))
+
+        solver.release()
+
+        assertEquals("cd", solver.decodeOutput(timeMajor(oneHot(63, 12, 13))))
+    }
+
+    @Test
+    fun `decodeOutput returns null for unsupported output`() {
+        assertNull(solver.decodeOutput("not a tensor"))
+        assertNull(solver.decodeOutput(null))
+    }
+
+    @Test
+    fun `flat decoding matches reshape-then-decode`() {
+        val random = Random(7)
+        val charset = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+        repeat(50) {
+            val numClasses = 63
+            val sequenceLength = 40
+            val output = FloatArray(sequenceLength * numClasses) { random.nextFloat() * 10f - 5f }
+
+            // Baseline algorithm: copy into [Time, Classes] rows, CTC-decode, keep 6 characters
+            val reshaped = Array(sequenceLength) { t ->
+                FloatArray(numClasses) { c -> output[t * numClasses + c] }
+            }
+            val expected = referenceCtcDecode(reshaped, charset)
+
+            assertEquals(expected, newSolver().decodeOutput(output))
+            assertEquals(expected, newSolver().decodeOutput(arrayOf(reshaped)))
+            assertEquals(expected, newSolver().decodeOutput(timeMajor(reshaped)))
+        }
+    }
+
+    @Test
+    fun `flat decoding stops at the CAPTCHA length`() {
+        // Eight distinct characters; the early break must keep exactly the first six
+        val rows = oneHot(63, 10, 11, 12, 13, 14, 15, 16, 17)
+        val output = flat(rows)
+
+        assertEquals("abcdef", solver.decodeOutput(output))
+        assertEquals(referenceCtcDecode(rows, "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"),
+            newSolver().decodeOutput(output))
+    }
+
+    @Test
+    fun `flat decoding reads the right class block with non-zero offsets`() {
+        // Larger values in other rows must not leak into a timestep's argmax
+        val rows = Array(3) { FloatArray(63) }
+        rows[0][10] = 1f
+        rows[0][62] = 0.5f
+        rows[1][62] = 9f
+        rows[2][11] = 2f
+        rows[2][0] = 1.5f
+
+        assertEquals("ab", solver.decodeOutput(flat(rows)))
+    }
+
+    private fun referenceCtcDecode(rows: Array<FloatArray>, charset: String): String {
+        val result = StringBuilder()
+        var previous = -1
+        for (row in rows) {
+            var best = 0
+            for (c in row.indices) if (row[c] > row[best]) best = c
+            if (best != BLANK && best != previous && best < charset.length) result.append(charset[best])
+            previous = best
+        }
+        return result.toString().take(6)
+    }
+
+    private fun newSolver() = CaptchaSolver(RuntimeEnvironment.getApplication())
+
+    private fun oneHot(numClasses: Int, vararg classes: Int): Array<FloatArray> =
+        Array(classes.size) { t -> FloatArray(numClasses).also { it[classes[t]] = 1f } }
+
+    private fun timeMajor(rows: Array<FloatArray>): Array<Array<FloatArray>> =
+        Array(rows.size) { t -> arrayOf(rows[t]) }
+
+    private fun flat(rows: Array<FloatArray>): FloatArray =
+        rows.fold(FloatArray(0)) { acc, row -> acc + row }
+
+    companion object {
+        private const val BLANK = 62
+    }
+}